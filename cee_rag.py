@@ -5,12 +5,46 @@ Uses Ollama (Qwen2.5:14b + nomic-embed-text) + ChromaDB
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Callable
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 
+# Maximum number of chunks sent to a single collection.add call
+ADD_BATCH_SIZE = 1000
+
+# Number of texts per /api/embed request, and how many requests run in parallel
+EMBED_BATCH_SIZE = 32
+EMBED_WORKERS = 4
+
+# Number of files read, chunked and embedded concurrently during folder ingest
+INGEST_WORKERS = 8
+
+# Sizes of the query embedding cache and the search result cache
+EMBED_CACHE_SIZE = 1024
+SEARCH_CACHE_SIZE = 256
+
+# A single whitespace-delimited word
+_WORD_RE = re.compile(r'\S+')
+
+# ChromaDB clients shared across CEEHistoryRAG instances, keyed by persist path,
+# so re-creating the RAG object doesn't reload the index from disk
+_CHROMA_CLIENTS = {}
+
+def get_chroma_client(path: str = "/home/data/chroma_db"):
+    """Return the shared PersistentClient for a path, creating it on first use"""
+    if path not in _CHROMA_CLIENTS:
+        _CHROMA_CLIENTS[path] = chromadb.PersistentClient(path=path)
+    return _CHROMA_CLIENTS[path]
+
 class CEEHistoryRAG:
     """RAG system for historical documents"""
     
@@ -19,39 +53,90 @@ class CEEHistoryRAG:
         self.llm_model = "qwen2.5:14b"
         self.embed_model = "nomic-embed-text"
         
+        # Persistent HTTP session so Ollama connections are kept alive and reused
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        ))
+        
         # Initialize ChromaDB with PersistentClient for automatic disk persistence
-        self.client = chromadb.PersistentClient(path="/home/data/chroma_db")
+        self.client = get_chroma_client("/home/data/chroma_db")
         
         # Get or create collection
+        # HNSW index parameters only take effect when the collection is first created;
+        # changing them requires deleting and rebuilding the collection
         self.collection = self.client.get_or_create_collection(
             name="cee_history",
-            metadata={"description": "CEE Economic History Documents"}
+            metadata={
+                "description": "CEE Economic History Documents",
+                "hnsw:space": "cosine",
+                "hnsw:M": 24,
+                "hnsw:construction_ef": 128,
+                "hnsw:search_ef": 100
+            }
+        )
+        
+        # Next free index for generated IDs; snapshotted from collection.count() on first use
+        self._next_id = None
+        
+        # Query caches: exact-text embedding LRU and search results keyed by embedding hash.
+        # The search cache is cleared whenever documents are added.
+        self._cached_embedding = lru_cache(maxsize=EMBED_CACHE_SIZE)(
+            lambda text: tuple(self.embed_texts([text])[0])
         )
+        self._search_cache: Dict[tuple, Dict] = {}
     
-    def embed_text(self, text: str) -> List[float]:
-        """Generate embeddings using nomic-embed-text"""
-        response = requests.post(
-            f"{self.ollama_url}/api/embeddings",
+    def _reserve_ids(self, n: int = 1) -> int:
+        """Reserve n consecutive indices for generated IDs and return the first one"""
+        if self._next_id is None:
+            self._next_id = self.collection.count()
+        base = self._next_id
+        self._next_id += n
+        return base
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for one batch of texts in a single request"""
+        response = self.session.post(
+            f"{self.ollama_url}/api/embed",
             json={
                 "model": self.embed_model,
-                "prompt": text
-            }
+                "input": texts
+            },
+            timeout=60
         )
         result = response.json()
-        if "embedding" not in result:
+        if "embeddings" not in result:
             print(f"ERROR: API response: {result}")
-            raise ValueError(f"Failed to get embedding: {result.get('error', 'Unknown error')}")
-        return result["embedding"]
+            raise ValueError(f"Failed to get embeddings: {result.get('error', 'Unknown error')}")
+        return result["embeddings"]
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for many texts, sending sub-batches to Ollama in parallel"""
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if len(batches) <= 1:
+            return self._embed_batch(texts) if texts else []
+        
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+            results = executor.map(self._embed_batch, batches)
+            return [embedding for batch in results for embedding in batch]
+    
+    def embed_text(self, text: str) -> List[float]:
+        """Generate embeddings using nomic-embed-text (cached per exact text)"""
+        return list(self._cached_embedding(text))
     
-    def add_document(self, text: str, metadata: Dict = None, doc_id: str = None, verbose: bool = True):
+    def add_document(self, text: str, metadata: Dict = None, doc_id: str = None, verbose: bool = True,
+                     embedding: List[float] = None):
         """Add a document to the vector database"""
         if doc_id is None:
-            doc_id = f"doc_{self.collection.count()}"
+            doc_id = f"doc_{self._reserve_ids()}"
         
         if verbose:
             print(f"  Embedding: {doc_id}...", end='', flush=True)
         
-        embedding = self.embed_text(text)
+        if embedding is None:
+            embedding = self.embed_text(text)
         
         self.collection.add(
             embeddings=[embedding],
@@ -59,6 +144,7 @@ class CEEHistoryRAG:
             metadatas=[metadata or {}],
             ids=[doc_id]
         )
+        self._search_cache.clear()
         
         if verbose:
             print(f" ✓")
@@ -72,59 +158,136 @@ class CEEHistoryRAG:
         
         print(f"  Found {len(files)} file(s)")
         
-        for idx, file_path in enumerate(files):
-            print(f"\n[{idx+1}/{len(files)}] Processing: {file_path.name}")
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-                word_count = len(text.split())
-                print(f"  Size: {len(text)} chars, {word_count} words")
-                metadata = {
-                    "filename": file_path.name,
-                    "source": str(file_path)
-                }
-                # Use chunked version for all documents to avoid context length issues
-                self.add_document_chunked(text, metadata, doc_id=file_path.stem)
+        # Read, chunk and embed files concurrently; writes to Chroma stay on this
+        # thread since the client isn't guaranteed to be thread-safe for writes
+        pending, pending_embeddings = [], []
+        with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+            results = executor.map(self._load_and_embed_file, files)
+            for idx, (file_path, prepared, embeddings) in enumerate(results):
+                print(f"[{idx+1}/{len(files)}] Embedded: {file_path.name} ({len(prepared)} chunks)")
+                pending.extend(prepared)
+                pending_embeddings.extend(embeddings)
+                
+                while len(pending) >= ADD_BATCH_SIZE:
+                    self._add_chunks(pending[:ADD_BATCH_SIZE], pending_embeddings[:ADD_BATCH_SIZE])
+                    pending = pending[ADD_BATCH_SIZE:]
+                    pending_embeddings = pending_embeddings[ADD_BATCH_SIZE:]
+        
+        if pending:
+            self._add_chunks(pending, pending_embeddings)
+    
+    def _load_and_embed_file(self, file_path: Path) -> tuple:
+        """Read, chunk and embed one file; returns (file_path, prepared chunks, embeddings)"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        metadata = {
+            "filename": file_path.name,
+            "source": str(file_path)
+        }
+        # Use chunked version for all documents to avoid context length issues
+        prepared = self._prepare_chunks(text, metadata, doc_id=file_path.stem, verbose=False)
+        print(f"  Read {file_path.name}: {len(text)} chars, {len(prepared)} chunk(s)")
+        
+        embeddings = self.embed_texts([chunk for _, chunk, _ in prepared])
+        return file_path, prepared, embeddings
+    
+    def _add_chunks(self, prepared: List[tuple], embeddings: List[List[float]] = None):
+        """Add prepared (chunk_id, chunk, metadata) tuples in one collection.add call, embedding them if needed"""
+        ids = [chunk_id for chunk_id, _, _ in prepared]
+        docs = [chunk for _, chunk, _ in prepared]
+        metas = [chunk_metadata for _, _, chunk_metadata in prepared]
+        
+        if embeddings is None:
+            print(f"\n  Embedding {len(docs)} chunk(s)...", end='', flush=True)
+            embeddings = self.embed_texts(docs)
+            print(" ✓")
+        
+        self.collection.add(
+            embeddings=embeddings,
+            documents=docs,
+            metadatas=metas,
+            ids=ids
+        )
+        self._search_cache.clear()
+        print(f"  Added {len(ids)} chunk(s)")
     
     def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
+        """Split text into overlapping chunks of chunk_size words"""
+        # Word boundaries from a single regex scan; chunks are sliced straight
+        # out of the original string instead of re-joining word lists
+        bounds = [m.span() for m in _WORD_RE.finditer(text)]
         chunks = []
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
+        for i in range(0, len(bounds), chunk_size - overlap):
+            last = bounds[min(i + chunk_size, len(bounds)) - 1]
+            chunks.append(text[bounds[i][0]:last[1]])
         
         return chunks
     
-    def add_document_chunked(self, text: str, metadata: Dict = None, doc_id: str = None):
-        """Add a document in chunks (better for large docs)"""
+    def _prepare_chunks(self, text: str, metadata: Dict = None, doc_id: str = None,
+                        verbose: bool = True) -> List[tuple]:
+        """Split a document into (chunk_id, chunk, metadata) tuples ready for embedding"""
         chunks = self.chunk_text(text)
         
-        print(f"  Chunking into {len(chunks)} pieces...")
+        if verbose:
+            print(f"  Chunking into {len(chunks)} pieces...")
         
+        base = self._reserve_ids(len(chunks)) if not doc_id else 0
+        prepared = []
         for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc_id}_chunk_{i}" if doc_id else f"chunk_{self.collection.count()}"
+            chunk_id = f"{doc_id}_chunk_{i}" if doc_id else f"chunk_{base + i}"
             chunk_metadata = metadata.copy() if metadata else {}
             chunk_metadata["chunk_index"] = i
             chunk_metadata["total_chunks"] = len(chunks)
-            
-            print(f"    [{i+1}/{len(chunks)}]", end=' ', flush=True)
-            self.add_document(chunk, chunk_metadata, chunk_id, verbose=True)
+            prepared.append((chunk_id, chunk, chunk_metadata))
+        
+        return prepared
+    
+    def add_document_chunked(self, text: str, metadata: Dict = None, doc_id: str = None):
+        """Add a document in chunks (better for large docs)"""
+        prepared = self._prepare_chunks(text, metadata, doc_id)
+        
+        for start in range(0, len(prepared), ADD_BATCH_SIZE):
+            self._add_chunks(prepared[start:start + ADD_BATCH_SIZE])
+    
+    def close(self):
+        """Close the HTTP session"""
+        self.session.close()
+    
+    def __del__(self):
+        if hasattr(self, "session"):
+            self.close()
     
     def search(self, query: str, n_results: int = 5) -> Dict:
         """Search for relevant documents"""
-        query_embedding = self.embed_text(query)
+        return self.search_by_embedding(self.embed_text(query), n_results)
+    
+    def search_by_embedding(self, query_embedding: List[float], n_results: int = 5) -> Dict:
+        """Search for relevant documents given an already computed query embedding"""
+        rounded = np.round(np.asarray(query_embedding, dtype=np.float32), 4)
+        cache_key = (hashlib.blake2b(rounded.tobytes()).digest(), n_results)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         results = self.collection.query(
             query_embeddings=[query_embedding],
             n_results=n_results
         )
         
+        if len(self._search_cache) >= SEARCH_CACHE_SIZE:
+            # Evict the oldest entry (dicts keep insertion order)
+            self._search_cache.pop(next(iter(self._search_cache)))
+        self._search_cache[cache_key] = results
+        
         return results
     
-    def generate_response(self, prompt: str, context: str = None, timeout: int = 120) -> str:
-        """Generate response using Qwen2.5"""
+    def generate_response(self, prompt: str, context: str = None, timeout: int = 120, stream: bool = False):
+        """
+        Generate response using Qwen2.5
+        
+        Returns the full answer as a string, or a generator of tokens when stream=True
+        """
         if context:
             full_prompt = f"""You are a research assistant with access to historical documents.
 
@@ -149,7 +312,10 @@ Respond with: "ERROR: No documents were retrieved from the database. The collect
 
 ANSWER:"""
         
-        response = requests.post(
+        if stream:
+            return self._stream_response(full_prompt, timeout)
+        
+        response = self.session.post(
             f"{self.ollama_url}/api/generate",
             json={
                 "model": self.llm_model,
@@ -161,16 +327,55 @@ ANSWER:"""
         
         return response.json()["response"]
     
-    def query(self, question: str, n_results: int = 3) -> str:
-        """Query the RAG system"""
+    def _stream_response(self, full_prompt: str, timeout: int):
+        """Yield response tokens from Ollama as they are generated"""
+        with self.session.post(
+            f"{self.ollama_url}/api/generate",
+            json={
+                "model": self.llm_model,
+                "prompt": full_prompt,
+                "stream": True
+            },
+            timeout=timeout,
+            stream=True
+        ) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                yield chunk.get("response", "")
+                if chunk.get("done"):
+                    break
+    
+    def query(self, question: str, n_results: int = 3, progress: Callable = None, stream: bool = False):
+        """
+        Query the RAG system
+        
+        Args:
+            question: Question to answer
+            n_results: Number of documents to retrieve
+            progress: Optional callback, called as progress(stage, results) before each
+                      stage ("embed", "search", "generate"); results is None until retrieved
+            stream: Return the answer as a generator of tokens
+        """
+        report = progress or (lambda stage, results=None: None)
+        
+        report("embed", None)
+        query_embedding = self.embed_text(question)
+        
         # Search for relevant context
-        results = self.search(question, n_results)
+        report("search", None)
+        results = self.search_by_embedding(query_embedding, n_results)
         
         # Combine retrieved documents
-        context = "\n\n---\n\n".join(results["documents"][0])
+        documents = results["documents"][0] if results["documents"] else []
+        context = "\n\n---\n\n".join(documents) if documents else None
         
         # Generate response
-        answer = self.generate_response(question, context)
+        report("generate", results)
+        answer = self.generate_response(question, context, stream=stream)
         
         return answer, results
     
@@ -178,13 +383,12 @@ ANSWER:"""
         """Find similar firm names (fuzzy matching via embeddings)"""
         results = self.search(firm_name, n_results)
         
-        matches = []
-        for i, doc in enumerate(results["documents"][0]):
-            matches.append({
-                "text": doc,
-                "distance": results["distances"][0][i],
-                "metadata": results["metadatas"][0][i]
-            })
+        matches = [
+            {"text": doc, "distance": distance, "metadata": metadata}
+            for doc, distance, metadata in zip(
+                results["documents"][0], results["distances"][0], results["metadatas"][0]
+            )
+        ]
         
         return matches
 
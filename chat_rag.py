@@ -4,6 +4,8 @@ Interactive chat interface for CEE History RAG system
 """
 
 import sys
+import requests
+from urllib3.exceptions import ReadTimeoutError
 from cee_rag import CEEHistoryRAG
 
 def print_separator():
@@ -25,6 +27,32 @@ def print_sources(results):
             preview += "..."
         print(f"      {preview}")
 
+def print_progress(stage, results=None):
+    """Progress callback for CEEHistoryRAG.query"""
+    if stage == "embed":
+        print("   [1/3] Embedding query...", end='', flush=True)
+    elif stage == "search":
+        print(" ✓")
+        print("   [2/3] Searching vector database...", end='', flush=True)
+    elif stage == "generate":
+        print(" ✓")
+        
+        # Debug: Show how many results were retrieved
+        retrieved_count = len(results["documents"][0]) if results["documents"] else 0
+        print(f"   Retrieved {retrieved_count} source(s)")
+        
+        if retrieved_count == 0:
+            print("\n⚠️  WARNING: No relevant documents found! The answer below is NOT based on your documents.\n")
+        else:
+            context_length = sum(len(doc.split()) for doc in results["documents"][0])
+            print(f"   Context length: {context_length} words")
+            
+            # Warn if context is very large
+            if context_length > 2000:
+                print(f"   ⚠️  Large context may slow down generation!")
+        
+        print("   [3/3] Generating answer...\n")
+
 def main():
     """Run interactive chat"""
     print("╔" + "═" * 78 + "╗")
@@ -113,42 +141,15 @@ def main():
         print("\n🤔 Thinking...\n")
         
         try:
-            print("   [1/3] Embedding query...", end='', flush=True)
-            # We'll need to call search directly to add progress
-            query_embedding = rag.embed_text(question)
-            print(" ✓")
-            
-            print("   [2/3] Searching vector database...", end='', flush=True)
-            results = rag.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results
-            )
-            print(" ✓")
-            
-            # Debug: Show how many results were retrieved
+            answer, results = rag.query(question, n_results, progress=print_progress, stream=True)
             retrieved_count = len(results["documents"][0]) if results["documents"] else 0
-            print(f"   Retrieved {retrieved_count} source(s)")
             
-            if retrieved_count == 0:
-                print("\n⚠️  WARNING: No relevant documents found! The answer below is NOT based on your documents.\n")
-                context = None
-            else:
-                context = "\n\n---\n\n".join(results["documents"][0])
-                context_length = len(context.split())
-                print(f"   Context length: {context_length} words")
-                
-                # Warn if context is very large
-                if context_length > 2000:
-                    print(f"   ⚠️  Large context may slow down generation!")
-            
-            print("   [3/3] Generating answer...", end='', flush=True)
-            answer = rag.generate_response(question, context)
-            print(" ✓\n")
-            
-            # Print answer
+            # Stream the answer as it is generated
             print("💬 Answer:")
             print("─" * 80)
-            print(answer)
+            for token in answer:
+                print(token, end='', flush=True)
+            print()
             print("─" * 80)
             
             # Print sources if enabled
@@ -157,17 +158,22 @@ def main():
             elif show_sources and retrieved_count == 0:
                 print("\n📚 Sources used: (none - database may be empty)")
         
-        except requests.exceptions.Timeout:
-            print(" ⏱️  TIMEOUT")
-            print("❌ The LLM took too long to respond (>120s). Try a simpler question or check if Ollama is overloaded.")
-        except Exception as e:
-            print(f"\n❌ ERROR: {e}")
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            # A read timeout while streaming surfaces as ConnectionError wrapping urllib3's ReadTimeoutError
+            if isinstance(e, requests.exceptions.Timeout) or (e.args and isinstance(e.args[0], ReadTimeoutError)):
+                print("\n⏱️  TIMEOUT")
+                print("❌ The LLM took too long to respond (>120s). Try a simpler question or check if Ollama is overloaded.")
+                continue
+            print(f"\n❌ CONNECTION ERROR: {e}")
             print("\nTrying to reconnect...")
             try:
+                # Reuses the already-loaded ChromaDB client, only the HTTP session is new
                 rag = CEEHistoryRAG()
                 print("✓ Reconnected")
             except:
                 print("❌ Could not reconnect. Check if Ollama is running.")
+        except Exception as e:
+            print(f"\n❌ ERROR: {e}")
 
 if __name__ == "__main__":
     main()
@@ -6,20 +6,158 @@ Uses OpenAI API to restructure data for better semantic search
 
 import os
 import sys
-import json
+import argparse
 import re
+import asyncio
+import hashlib
+import heapq
+import sqlite3
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+import httpx
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:  # fall back to the slower standard library parser
+    import json
+    json_loads = json.loads
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:  # stay on HTTP/1.1 keep-alive connections
+    HTTP2_AVAILABLE = False
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a characters/4 estimate
+    tiktoken = None
+
+# Maximum number of OpenAI requests in flight at once
+MAX_CONCURRENCY = 10
+
+# Connection pool of the HTTP client shared by all API requests, and its timeout in seconds
+HTTP_MAX_CONNECTIONS = 200
+HTTP_TIMEOUT = 60.0
+
+# Bounds on generated tokens per formatted firm record; the actual
+# reservation is sized from the input (see output_token_budget)
+MIN_OUTPUT_TOKENS = 256
+MAX_OUTPUT_TOKENS = 2000
+
+# Per-record user message; the static instructions live in the system prompt
+USER_TEMPLATE = "RAW FIRM DATA:\n{firm_data}\n\nFORMATTED TEXT:"
+
+# Retries after a 429, timeout, connection or 5xx error (exponential backoff starting
+# at RETRY_BASE_DELAY seconds); the SDK's own retries are disabled in the regular mode
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2.0
+
+# Structured output (--structured): the model fills this schema and the text is
+# rendered locally, so every record comes out with the same layout
+STRUCTURED_PROMPT_FILE = "rag_structured_prompt.txt"
+FIRM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source": {"type": "string"},
+        "company_info": {"type": "string"},
+        "leadership": {"type": "string"},
+        "financials": {"type": "string"},
+        "other_sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "text": {"type": "string"}
+                },
+                "required": ["title", "text"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["source", "company_info", "leadership", "financials", "other_sections"],
+    "additionalProperties": False
+}
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "firm", "schema": FIRM_SCHEMA, "strict": True}
+}
+
+# Tiered routing (--fast-model): records up to this many input tokens try the
+# cheap model first and escalate only if its output fails looks_formatted()
+FAST_MODEL_MAX_TOKENS = 1500
+_LIST_LINE_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s', re.M)
+
+# Multi-record requests: output token ceiling per request, and instructions
+# appended to the system prompt when several records are packed together
+PACKED_MAX_TOKENS = 4096
+PACKED_INSTRUCTIONS = """
+The user message contains several records, each introduced by a <<<REC N>>> marker.
+Format each record independently following the rules above.
+Respond with a JSON object of the form {"results": [{"id": N, "text": "..."}, ...]}
+with exactly one entry per record."""
+
+# Batch API polling interval bounds, in seconds (exponential backoff between them)
+BATCH_POLL_MIN = 10
+BATCH_POLL_MAX = 300
+# Batch API input file limits: 50,000 requests and 200 MB (bytes kept a little under)
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+
+# Pipeline tuning: processes parsing page files, pages formatted at once,
+# and bounded queue size between stages
+LOAD_WORKERS = os.cpu_count() or 1
+FORMAT_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 4
+
+# Sidecar manifest in the output folder listing pages already written, so an
+# interrupted run can resume without re-formatting them
+MANIFEST_NAME = ".done.jsonl"
+
+# Precompiled filename pattern for natural sorting
+_NAT_RE = re.compile(r'(\d+)')
+
+# Records mentioning a firm name together with a missing-value marker (either order)
+MISSING_RE = re.compile(r'firm name.*(?:unknown|missing|n/a)|(?:unknown|missing|n/a).*firm name', re.S)
 
 def natural_sort_key(filename: str) -> tuple:
     """
     Sort filenames naturally (page_1, page_2, ..., page_10, page_11)
     instead of alphabetically (page_1, page_10, page_11, page_2)
+    Fallback for arbitrary filenames; page_N.json files are sorted by N directly
     """
-    parts = re.split(r'(\d+)', filename)
-    return tuple(int(part) if part.isdigit() else part for part in parts)
+    return tuple(int(part) if part.isdigit() else part for part in _NAT_RE.split(filename))
+
+def _walk_page_files(root: str) -> Iterator[os.DirEntry]:
+    """
+    Iteratively walk root with os.scandir, yielding page_*.json entries
+    Avoids the per-file Path objects and extra stat calls of rglob
+    """
+    stack = [root]
+    while stack:
+        # Unreadable directories (or a root that is a file) are skipped, as rglob does
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.startswith("page_") and entry.name.endswith(".json"):
+                    yield entry
 
 def find_page_json_files(input_folder: Path) -> List[Path]:
     """
@@ -28,79 +166,322 @@ def find_page_json_files(input_folder: Path) -> List[Path]:
     """
     page_files = []
     
-    for json_file in input_folder.rglob("*.json"):
-        # Check if filename matches page_N pattern
-        if re.match(r'page_\d+\.json$', json_file.name):
-            page_files.append(json_file)
+    for entry in _walk_page_files(str(input_folder)):
+        # Check that the part between 'page_' and '.json' is a number
+        # (isdecimal rather than isdigit, which also accepts characters int() rejects)
+        number = entry.name[5:-5]
+        if number.isdecimal():
+            page_files.append((int(number), entry.path))
     
-    # Sort naturally
-    page_files.sort(key=lambda x: natural_sort_key(x.name))
-    return page_files
+    # Sort by page number (equivalent to natural order for page_N.json names)
+    page_files.sort(key=itemgetter(0))
+    # Only the survivors are turned into Path objects
+    return [Path(path) for _, path in page_files]
 
-def extract_firm_records(json_data: Dict) -> List[str]:
+def extract_firm_records(json_data: Dict) -> Iterator[str]:
     """
     Extract firm records from JSON data
-    Looks for 'shapes' list and extracts 'openai_outputs' from each element
+    Looks for 'shapes' list and yields 'openai_outputs' from each element
     Skips records without a firm name
     """
-    firm_records = []
+    for shape in json_data.get('shapes', ()):
+        if not isinstance(shape, dict):
+            continue
+        openai_output = shape.get('openai_outputs')
+        if openai_output:  # Not empty
+            # Convert to string if it's a list or other type
+            if isinstance(openai_output, list):
+                openai_output = ' '.join(map(str, openai_output))
+            elif not isinstance(openai_output, str):
+                openai_output = str(openai_output)
+            
+            # Skip empty/whitespace or very short text before doing any case folding
+            if len(openai_output) < 10 or len(openai_output.strip()) < 10:
+                continue
+            # Skip if it looks like it has no firm name
+            if MISSING_RE.search(openai_output.lower()):
+                continue
+            yield openai_output
+
+class FormatCache:
+    """
+    SQLite-backed cache of formatted texts, so re-runs don't re-bill records
+    """
     
-    if 'shapes' not in json_data:
-        return firm_records
+    def __init__(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS formatted (key BLOB PRIMARY KEY, text BLOB)")
+        self.conn.commit()
     
-    for shape in json_data['shapes']:
-        if isinstance(shape, dict) and 'openai_outputs' in shape:
-            openai_output = shape['openai_outputs']
-            if openai_output:  # Not empty
-                # Convert to string if it's a list or other type
-                if isinstance(openai_output, list):
-                    openai_output = ' '.join(str(item) for item in openai_output)
-                elif not isinstance(openai_output, str):
-                    openai_output = str(openai_output)
-                
-                # Skip if no firm name (check for common indicators)
-                openai_lower = openai_output.lower()
-                # Skip if it looks like it has no firm name
-                if 'firm name' in openai_lower and ('unknown' in openai_lower or 'missing' in openai_lower or 'n/a' in openai_lower):
-                    continue
-                # Also check if the text is just empty/whitespace or very short
-                if len(openai_output.strip()) < 10:
-                    continue
-                firm_records.append(openai_output)
+    def get(self, key: bytes) -> str:
+        """
+        Return the cached text for key, or None on a miss
+        """
+        row = self.conn.execute("SELECT text FROM formatted WHERE key = ?", (key,)).fetchone()
+        return row[0].decode('utf-8') if row else None
     
-    return firm_records
+    def put(self, key: bytes, text: str):
+        """
+        Store a formatted text (first write wins)
+        """
+        self.conn.execute("INSERT OR IGNORE INTO formatted (key, text) VALUES (?, ?)",
+                          (key, text.encode('utf-8')))
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
 
-def format_for_rag(firm_data: str, model: str, client: OpenAI, source_name: str = None, prompt_file: str = "rag_formatting_prompt.txt") -> str:
+def open_format_cache(output_path: Path, use_cache: bool = True, cache_path: str = None) -> FormatCache:
     """
-    Send firm data to OpenAI API to reformat for RAG
+    Open the response cache (default: <output_folder>/.format_cache.sqlite), or None if disabled
     """
-    source_instruction = ""
-    if source_name:
-        source_instruction = f"\n7. Begin the output with: 'Source: {source_name}'"
+    if not use_cache:
+        return None
+    return FormatCache(Path(cache_path) if cache_path else output_path / ".format_cache.sqlite")
+
+def make_openai_client(api_key: str, max_retries: int = 2) -> AsyncOpenAI:
+    """
+    AsyncOpenAI client on one pooled httpx client shared by all tasks
+    Uses HTTP/2 when the h2 package is installed; the transport itself never retries
+    (max_retries=0 leaves all retrying to create_completion, behind the RateLimiter)
+    """
+    http_client = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, retries=0),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        timeout=HTTP_TIMEOUT
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=max_retries)
+
+class RateLimiter:
+    """
+    Token bucket limiting requests and/or tokens per minute (None = that limit is off)
+    Buckets refill continuously; acquire() waits until every enabled bucket has capacity
+    """
+    
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self.available_request_capacity = self.rpm
+        self.available_token_capacity = self.tpm
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
     
-    # Load prompt from file
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if self.rpm is not None:
+            self.available_request_capacity = min(self.rpm, self.available_request_capacity + elapsed * self.rpm / 60.0)
+        if self.tpm is not None:
+            self.available_token_capacity = min(self.tpm, self.available_token_capacity + elapsed * self.tpm / 60.0)
+    
+    def _wait_time(self, tokens: int) -> float:
+        """
+        Seconds until every enabled bucket can cover the request (0 if it fits now)
+        Disabled buckets are left out, so the result is always finite
+        """
+        wait = 0.0
+        if self.rpm is not None:
+            wait = max(wait, (1 - self.available_request_capacity) * 60.0 / self.rpm)
+        if self.tpm is not None:
+            wait = max(wait, (tokens - self.available_token_capacity) * 60.0 / self.tpm)
+        return wait
+    
+    async def acquire(self, tokens: int):
+        """
+        Wait for capacity for one request consuming the given number of tokens
+        """
+        # A request larger than the whole bucket still has to go through eventually
+        if self.tpm is not None:
+            tokens = min(tokens, self.tpm)
+        # Waiters queue on the lock, so capacity is handed out in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    if self.rpm is not None:
+                        self.available_request_capacity -= 1
+                    if self.tpm is not None:
+                        self.available_token_capacity -= tokens
+                    return
+                await asyncio.sleep(max(wait, 0.01))
+
+async def create_completion(client: AsyncOpenAI, semaphore: asyncio.Semaphore, limiter: RateLimiter,
+                            **request):
+    """
+    Call chat.completions.create within the concurrency and rate limits, retrying on 429s
+    and transient errors; every attempt goes through the limiter
+    """
+    estimated_tokens = request["max_tokens"] + sum(
+        count_tokens(message["content"], request["model"]) for message in request["messages"]
+    )
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            await limiter.acquire(estimated_tokens)
+        try:
+            async with semaphore:
+                return await client.chat.completions.create(**request)
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            reason = "Rate limited" if isinstance(e, openai.RateLimitError) else f"Request failed ({e})"
+            print(f"⚠️  {reason}, retrying in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+
+@lru_cache(maxsize=None)
+def load_prompt(prompt_file: str = "rag_formatting_prompt.txt") -> str:
+    """
+    Load the formatting instructions from a file next to this script
+    """
     prompt_path = Path(__file__).parent / prompt_file
+    with open(prompt_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
     try:
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            prompt = f.read()
-    except FileNotFoundError:
-        print(f"❌ ERROR: Prompt file not found: {prompt_path}")
-        return f"[ERROR: PROMPT FILE NOT FOUND]\n{firm_data}"
-    
-    full_prompt = prompt.format(firm_data=firm_data, source_instruction=source_instruction)
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Number of tokens in text for the given model (estimated if tiktoken is not installed)
+    """
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_get_encoding(model).encode(text))
+
+def output_token_budget(firm_data: str, model: str) -> int:
+    """
+    max_tokens for formatting a record, estimated from its input size
+    Smaller reservations use less of the tokens-per-minute rate limit
+    """
+    return min(MAX_OUTPUT_TOKENS, max(MIN_OUTPUT_TOKENS, int(count_tokens(firm_data, model) * 1.5) + 100))
+
+def group_records(firm_records: List[str], model: str, records_per_request: int) -> List[List[int]]:
+    """
+    Split record indices into groups of up to records_per_request records whose
+    combined output budgets fit PACKED_MAX_TOKENS, the packed request's max_tokens
+    """
+    groups = []
+    current, current_tokens = [], 0
+    for idx, firm_data in enumerate(firm_records):
+        tokens = output_token_budget(firm_data, model)
+        if current and (len(current) >= records_per_request or current_tokens + tokens > PACKED_MAX_TOKENS):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def build_user_template(source_name: str = None) -> str:
+    """
+    Build the per-record user message template, once per run
+    The source goes here rather than in the system prompt, which must stay
+    byte-identical across calls so OpenAI's prompt prefix cache can match it
+    """
+    source_line = f"Source: {source_name}\n\n" if source_name else ""
+    return source_line + USER_TEMPLATE
+
+def render_user_message(user_template: str, firm_data: str) -> str:
+    """
+    Fill a record into the user template (str.replace avoids re-parsing a format string)
+    """
+    return user_template.replace("{firm_data}", firm_data)
 
+def render_structured(firm: Dict) -> str:
+    """
+    Render a FIRM_SCHEMA response as paragraphs, in the same shape as the free-form output
+    """
+    paragraphs = [f"Source: {firm['source']}"] if firm["source"].strip() else []
+    for field in ("company_info", "leadership", "financials"):
+        if firm[field].strip():
+            paragraphs.append(firm[field].strip())
+    for section in firm["other_sections"]:
+        if section["text"].strip():
+            paragraphs.append(section["text"].strip())
+    return "\n\n".join(paragraphs)
+
+def format_cache_key(model: str, system_prompt: str, user_message: str, fast_model: str = None) -> bytes:
+    """
+    Cache key for a formatted record; prompt edits and source changes also invalidate it
+    """
+    route = f"{fast_model}>{model}" if fast_model else model
+    return hashlib.blake2b(f"{route}|{system_prompt}|{user_message}".encode('utf-8'), digest_size=16).digest()
+
+def looks_formatted(formatted_text: str, user_message: str) -> bool:
+    """
+    Cheap check of a fast-model output against the prompt rules, deciding escalation
+    """
+    if len(formatted_text) < 20:
+        return False
+    # Rule 7: the Source line must be carried over verbatim
+    if user_message.startswith("Source:") and not formatted_text.startswith(user_message.split("\n", 1)[0]):
+        return False
+    # Rule 2: flowing sentences, no bullet points or numbered lists
+    return not _LIST_LINE_RE.search(formatted_text)
+
+async def format_for_rag(firm_data: str, model: str, client: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                         system_prompt: str, user_template: str, cache: FormatCache = None,
+                         limiter: RateLimiter = None, structured: bool = False, fast_model: str = None,
+                         stats: Counter = None) -> str:
+    """
+    Send firm data to OpenAI API to reformat for RAG
+    system_prompt and user_template are built once per run (load_prompt, build_user_template)
+    Responses are cached in cache (if given), keyed by model, prompt and firm data
+    With structured=True the response follows FIRM_SCHEMA and is rendered locally
+    With fast_model, short records go to it first and escalate to model on a bad output
+    (counted in stats["escalated"])
+    """
+    user_message = render_user_message(user_template, firm_data)
+    cache_key = format_cache_key(model, system_prompt, user_message, fast_model)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    models = [model]
+    if fast_model and count_tokens(firm_data, model) <= FAST_MODEL_MAX_TOKENS:
+        models.insert(0, fast_model)
+    
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a precise data formatting assistant. Return only the formatted text, nothing else."},
-                {"role": "user", "content": full_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=2000
-        )
-        
-        formatted_text = response.choices[0].message.content.strip()
+        for request_model in models:
+            try:
+                response = await create_completion(
+                    client, semaphore, limiter,
+                    model=request_model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    temperature=0.3,
+                    max_tokens=output_token_budget(firm_data, model),
+                    **({"response_format": STRUCTURED_RESPONSE_FORMAT} if structured else {})
+                )
+                content = response.choices[0].message.content
+                formatted_text = render_structured(json_loads(content)) if structured else content.strip()
+            except Exception as e:
+                # The final tier's errors are reported below; a fast-model failure escalates
+                if request_model == model:
+                    raise
+                print(f"⚠️  {request_model} request failed ({e}), escalating to {model}")
+            else:
+                # The final tier is accepted as is; a fast-model output has to pass looks_formatted
+                if request_model == model or looks_formatted(formatted_text, user_message):
+                    break
+                print(f"⚠️  {request_model} output failed validation, escalating to {model}")
+            if stats is not None:
+                stats["escalated"] += 1
         
         print("\n" + "─"*80)
         print("📥 OPENAI RESPONSE:")
@@ -108,120 +489,620 @@ def format_for_rag(firm_data: str, model: str, client: OpenAI, source_name: str
         print(formatted_text)
         print("─"*80 + "\n")
         
+        if cache is not None:
+            cache.put(cache_key, formatted_text)
+        
         return formatted_text
         
     except Exception as e:
         print(f"❌ ERROR calling OpenAI API: {e}\n")
         return f"[ERROR FORMATTING]\n{firm_data}"
 
-def process_json_files(input_folder: str, model: str, api_key: str, output_folder: str, source_name: str = None):
+async def format_for_rag_batch(firm_records: List[str], model: str, client: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                               system_prompt: str, user_template: str, cache: FormatCache = None,
+                               limiter: RateLimiter = None, fast_model: str = None,
+                               stats: Counter = None) -> List[str]:
     """
-    Main processing function
+    Format several firm records with a single API request
+    Falls back to one request per record if the response can't be parsed
+    Packed requests always use model; fast_model only applies to the per-record fallback
     """
-    input_path = Path(input_folder)
-    output_path = Path(output_folder)
-    output_path.mkdir(exist_ok=True, parents=True)
+    # Only records missing from the cache are sent
+    cache_keys = [format_cache_key(model, system_prompt, render_user_message(user_template, firm_data), fast_model)
+                  for firm_data in firm_records]
+    formatted_texts = [cache.get(key) if cache is not None else None for key in cache_keys]
+    missing = [idx for idx, text in enumerate(formatted_texts) if text is None]
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    if len(missing) == 1:
+        idx = missing[0]
+        formatted_texts[idx] = await format_for_rag(firm_records[idx], model, client, semaphore,
+                                                    system_prompt, user_template, cache=cache, limiter=limiter,
+                                                    fast_model=fast_model, stats=stats)
+    elif missing:
+        user_message = render_user_message(user_template, "RECORDS:\n" + "".join(
+            f"<<<REC {n}>>>\n{firm_records[idx]}\n" for n, idx in enumerate(missing, 1)
+        ))
+        try:
+            response = await create_completion(
+                client, semaphore, limiter,
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt + PACKED_INSTRUCTIONS},
+                    {"role": "user", "content": user_message}
+                ],
+                temperature=0.3,
+                max_tokens=min(PACKED_MAX_TOKENS,
+                               sum(output_token_budget(firm_records[idx], model) for idx in missing)),
+                response_format={"type": "json_object"}
+            )
+            parsed = json_loads(response.choices[0].message.content)
+            texts = {int(item["id"]): item["text"].strip() for item in parsed["results"]}
+            if set(texts) != set(range(1, len(missing) + 1)):
+                raise ValueError(f"expected {len(missing)} results, got ids {sorted(texts)}")
+        except Exception as e:
+            print(f"⚠️  Could not format {len(missing)} records in one request ({e}), retrying one by one")
+            retried = await asyncio.gather(*(
+                format_for_rag(firm_records[idx], model, client, semaphore, system_prompt, user_template,
+                               cache=cache, limiter=limiter, fast_model=fast_model, stats=stats)
+                for idx in missing
+            ))
+            for idx, text in zip(missing, retried):
+                formatted_texts[idx] = text
+        else:
+            print("\n" + "─"*80)
+            print(f"📥 OPENAI RESPONSE ({len(missing)} records):")
+            print("─"*80)
+            for n, idx in enumerate(missing, 1):
+                formatted_texts[idx] = texts[n]
+                print(texts[n] + "\n")
+                if cache is not None:
+                    cache.put(cache_keys[idx], texts[n])
+            print("─"*80 + "\n")
+    
+    return formatted_texts
+
+def load_page_json(json_file: Path) -> Dict:
+    """
+    Read and parse a page JSON file
+    """
+    # Parse the raw bytes directly, skipping a separate UTF-8 decode step
+    with open(json_file, 'rb', buffering=1 << 20) as f:
+        return json_loads(f.read())
+
+def load_and_extract(json_file: Path) -> List[str]:
+    """
+    Read a page JSON file and return its firm records (runs in a worker process)
+    """
+    return list(extract_firm_records(load_page_json(json_file)))
+
+def page_output_file(output_path: Path, json_file: Path) -> Path:
+    """
+    Output file for a page
+    Includes parent folder name to avoid overwrites when processing recursively
+    """
+    return output_path / f"{json_file.parent.name}_{json_file.stem}_firms.txt"
+
+def write_firm_records(output_file: Path, json_file: Path, formatted_texts: List[str], first_record: int):
+    """
+    Write the formatted records of one page to its output file
+    """
+    parts = []
+    for firm_idx, formatted_text in enumerate(formatted_texts, 1):
+        parts.append("="*80 + "\n")
+        parts.append(f"FIRM RECORD {first_record + firm_idx - 1}\n")
+        parts.append(f"Source: {json_file.name}, Record {firm_idx}\n")
+        parts.append("="*80 + "\n\n")
+        parts.append(formatted_text)
+        parts.append("\n\n")
+    
+    # Single write into a temp file, then an atomic rename, so a crash never
+    # leaves a half-written page behind
+    tmp_file = output_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8', buffering=1 << 20) as out_f:
+        out_f.write("".join(parts))
+    os.replace(tmp_file, output_file)
+
+def page_digest(model: str, system_prompt: str, user_template: str, firm_records: List[str]) -> str:
+    """
+    Fingerprint of everything that determines a page's output
+    """
+    h = hashlib.blake2b(f"{model}|{system_prompt}|{user_template}".encode('utf-8'), digest_size=16)
+    for firm_data in firm_records:
+        h.update(b"\x00" + firm_data.encode('utf-8'))
+    return h.hexdigest()
+
+def load_manifest(manifest_path: Path) -> Dict[str, Dict]:
+    """
+    Load {page key: entry} from the manifest; later entries override earlier ones
+    A line truncated by a crash is ignored
+    """
+    done = {}
+    if not manifest_path.exists():
+        return done
+    with open(manifest_path, 'rb') as f:
+        for line in f:
+            try:
+                entry = json_loads(line)
+            except ValueError:
+                continue
+            done[entry["file"]] = entry
+    return done
+
+def renumber_firm_records(output_file: Path, old_first: int, new_first: int):
+    """
+    Shift the FIRM RECORD numbers of a resumed page whose predecessors changed size
+    """
+    text = output_file.read_text(encoding='utf-8')
+    text = re.sub(r'^FIRM RECORD (\d+)$', lambda m: f"FIRM RECORD {int(m[1]) - old_first + new_first}",
+                  text, flags=re.M)
+    tmp_file = output_file.with_suffix(".tmp")
+    tmp_file.write_text(text, encoding='utf-8')
+    os.replace(tmp_file, output_file)
+
+def build_batch_jsonl(batch_requests: List[tuple], model: str, output_dir: Path,
+                      structured: bool = False) -> List[Path]:
+    """
+    Write Batch API input: one chat completion request per (custom_id, system_prompt, user_message)
+    Split across as many files as needed to stay under BATCH_MAX_REQUESTS and BATCH_MAX_BYTES each
+    """
+    batch_paths = []
+    f = None
+    count = size = 0
+    try:
+        for custom_id, system_prompt, user_message in batch_requests:
+            line = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": output_token_budget(user_message, model)
+                }
+            }
+            if structured:
+                line["body"]["response_format"] = STRUCTURED_RESPONSE_FORMAT
+            data = json_dumps(line) + b"\n"
+            if f is None or count >= BATCH_MAX_REQUESTS or size + len(data) > BATCH_MAX_BYTES:
+                if f is not None:
+                    f.close()
+                batch_paths.append(output_dir / f".batch_input_{len(batch_paths) + 1}.jsonl")
+                f = open(batch_paths[-1], 'wb')
+                count = size = 0
+            f.write(data)
+            count += 1
+            size += len(data)
+    finally:
+        if f is not None:
+            f.close()
+    return batch_paths
+
+async def run_batch(client: AsyncOpenAI, batch_path: Path) -> Dict[str, str]:
+    """
+    Upload a Batch API input file, wait for the batch to finish and return {custom_id: text}
+    """
+    with open(batch_path, 'rb') as f:
+        input_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id}")
     
-    # Find all page JSON files
-    print(f"Scanning for page_N.json files in: {input_path}")
-    json_files = find_page_json_files(input_path)
+    delay = BATCH_POLL_MIN
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        done = f" ({counts.completed}/{counts.total} done)" if counts else ""
+        print(f"  Batch status: {batch.status}{done}")
     
-    if not json_files:
-        print("No page_N.json files found!")
-        return
+    if batch.status != "completed":
+        print(f"❌ ERROR: Batch ended with status '{batch.status}'")
+        return {}
+    if not batch.output_file_id:
+        return {}
     
-    print(f"Found {len(json_files)} page files")
-    if source_name:
-        print(f"Source attribution: {source_name}")
-    print()
+    content = await client.files.content(batch.output_file_id)
+    outputs = {}
+    for line in content.content.splitlines():
+        if not line.strip():
+            continue
+        item = json_loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") != 200:
+            print(f"❌ ERROR in batch request {item.get('custom_id')}: {item.get('error') or response}")
+            continue
+        outputs[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    return outputs
+
+async def process_json_files_batch_async(input_folder: str, model: str, api_key: str, output_folder: str,
+                                         source_name: str = None, cache: FormatCache = None,
+                                         structured: bool = False):
+    """
+    Process all page files through the OpenAI Batch API (half price, no per-minute request limits)
+    Produces the same per-page output files as the regular mode
+    """
+    input_path = Path(input_folder)
+    output_path = Path(output_folder)
+    output_path.mkdir(exist_ok=True, parents=True)
     
-    # Process each file
-    total_firms = 0
+    client = make_openai_client(api_key)
     
-    for file_idx, json_file in enumerate(json_files, 1):
-        print(f"[{file_idx}/{len(json_files)}] Processing: {json_file.name}")
+    try:
+        prompt_file = STRUCTURED_PROMPT_FILE if structured else "rag_formatting_prompt.txt"
+        try:
+            system_prompt = load_prompt(prompt_file)
+        except FileNotFoundError:
+            print(f"❌ ERROR: Prompt file not found: {Path(__file__).parent / prompt_file}")
+            return
+        user_template = build_user_template(source_name)
+        
+        print(f"Scanning for page_N.json files in: {input_path}")
+        json_files = find_page_json_files(input_path)
+        
+        if not json_files:
+            print("No page_N.json files found!")
+            return
+        
+        print(f"Found {len(json_files)} page files")
+        if source_name:
+            print(f"Source attribution: {source_name}")
+        print()
+        
+        # Collect all records; cached ones are filled in right away
+        pages = []  # (json_file, firm_records, formatted_texts)
+        batch_requests = []
+        for page_idx, json_file in enumerate(json_files):
+            try:
+                json_data = load_page_json(json_file)
+            except Exception as e:
+                print(f"  ERROR reading JSON {json_file.name}: {e}")
+                continue
+            
+            firm_records = list(extract_firm_records(json_data))
+            formatted_texts = [None] * len(firm_records)
+            for record_idx, firm_data in enumerate(firm_records):
+                user_message = render_user_message(user_template, firm_data)
+                cached = cache.get(format_cache_key(model, system_prompt, user_message)) if cache is not None else None
+                if cached is not None:
+                    formatted_texts[record_idx] = cached
+                else:
+                    batch_requests.append((f"{len(pages)}:{record_idx}", system_prompt, user_message))
+            pages.append((json_file, firm_records, formatted_texts))
+        
+        print(f"{len(batch_requests)} firm record(s) to format, "
+              f"{sum(len(records) for _, records, _ in pages) - len(batch_requests)} from cache")
+        
+        if batch_requests:
+            batch_paths = build_batch_jsonl(batch_requests, model, output_path, structured=structured)
+            if len(batch_paths) > 1:
+                print(f"Splitting into {len(batch_paths)} batches to stay under the Batch API file limits")
+            outputs = {}
+            for batch_outputs in await asyncio.gather(*(run_batch(client, path) for path in batch_paths)):
+                outputs.update(batch_outputs)
+            
+            for custom_id, text in outputs.items():
+                page_idx, record_idx = map(int, custom_id.split(":"))
+                _, firm_records, formatted_texts = pages[page_idx]
+                if structured:
+                    try:
+                        text = render_structured(json_loads(text))
+                    except Exception as e:
+                        print(f"❌ ERROR parsing structured output for {custom_id}: {e}")
+                        continue
+                formatted_texts[record_idx] = text
+                if cache is not None:
+                    user_message = render_user_message(user_template, firm_records[record_idx])
+                    cache.put(format_cache_key(model, system_prompt, user_message), text)
+        
+        total_firms = 0
+        for json_file, firm_records, formatted_texts in pages:
+            if not firm_records:
+                continue
+            # Records missing from the batch output keep their slot as an error placeholder
+            formatted_texts = [text if text is not None else f"[ERROR FORMATTING]\n{firm_data}"
+                               for firm_data, text in zip(firm_records, formatted_texts)]
+            output_file = page_output_file(output_path, json_file)
+            write_firm_records(output_file, json_file, formatted_texts, total_firms + 1)
+            total_firms += len(formatted_texts)
+            print(f"  Saved to: {output_file}")
+        
+        print("="*80)
+        print(f"Processing complete!")
+        print(f"Total firms processed: {total_firms}")
+        print(f"Output saved to: {output_path}")
+        print("="*80)
+    finally:
+        # Also closes the shared httpx client
+        await client.close()
+
+def process_json_files(input_folder: str, model: str, api_key: str, output_folder: str, source_name: str = None,
+                       max_concurrency: int = MAX_CONCURRENCY, batch: bool = False,
+                       records_per_request: int = 1, use_cache: bool = True, cache_path: str = None,
+                       rpm: float = None, tpm: float = None, structured: bool = False, resume: bool = True,
+                       fast_model: str = None):
+    """
+    Main processing function
+    """
+    # Formatted outputs are cached so re-runs skip records already sent to the API
+    cache = open_format_cache(Path(output_folder), use_cache, cache_path)
+    try:
+        if batch:
+            asyncio.run(process_json_files_batch_async(input_folder, model, api_key, output_folder, source_name,
+                                                       cache=cache, structured=structured))
+        else:
+            asyncio.run(process_json_files_async(input_folder, model, api_key, output_folder, source_name,
+                                                 max_concurrency=max_concurrency,
+                                                 records_per_request=records_per_request, cache=cache,
+                                                 rpm=rpm, tpm=tpm, structured=structured, resume=resume,
+                                                 fast_model=fast_model))
+    finally:
+        if cache is not None:
+            cache.close()
+
+async def process_json_files_async(input_folder: str, model: str, api_key: str, output_folder: str,
+                                   source_name: str = None, max_concurrency: int = MAX_CONCURRENCY,
+                                   records_per_request: int = 1, cache: FormatCache = None,
+                                   rpm: float = None, tpm: float = None, structured: bool = False,
+                                   resume: bool = True, fast_model: str = None):
+    """
+    Process all page files, overlapping JSON reads, API calls and output writes
+    Up to max_concurrency OpenAI requests are in flight at once, across pages;
+    with records_per_request > 1 several records of a page share one request
+    With resume, pages listed in the manifest with unchanged inputs are skipped
+    """
+    input_path = Path(input_folder)
+    output_path = Path(output_folder)
+    output_path.mkdir(exist_ok=True, parents=True)
+    
+    # Initialize OpenAI client; create_completion does all retrying, through the limiter
+    client = make_openai_client(api_key, max_retries=0)
+    try:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # Proactive throttling to stay under the account's rate limits (None = unlimited)
+        limiter = RateLimiter(rpm, tpm) if (rpm or tpm) else None
+        if structured and records_per_request > 1:
+            print("⚠️  Structured output formats one record per request; ignoring --records-per-request")
+            records_per_request = 1
         
-        # Read JSON
+        # Prompts are invariant for the whole run: load and render them once
+        prompt_file = STRUCTURED_PROMPT_FILE if structured else "rag_formatting_prompt.txt"
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-        except Exception as e:
-            print(f"  ERROR reading JSON: {e}")
-            continue
+            system_prompt = load_prompt(prompt_file)
+        except FileNotFoundError:
+            print(f"❌ ERROR: Prompt file not found: {Path(__file__).parent / prompt_file}")
+            return
+        user_template = build_user_template(source_name)
         
-        # Extract firm records
-        firm_records = extract_firm_records(json_data)
+        # Find all page JSON files
+        print(f"Scanning for page_N.json files in: {input_path}")
+        json_files = find_page_json_files(input_path)
         
-        if not firm_records:
-            print(f"  No firm records found")
-            continue
+        if not json_files:
+            print("No page_N.json files found!")
+            return
         
-        print(f"  Found {len(firm_records)} firm record(s)")
+        print(f"Found {len(json_files)} page files")
+        if source_name:
+            print(f"Source attribution: {source_name}")
         
-        # Create output file for this page
-        # Include parent folder name to avoid overwrites when processing recursively
-        parent_folder = json_file.parent.name
-        output_file = output_path / f"{parent_folder}_{json_file.stem}_firms.txt"
+        manifest_path = output_path / MANIFEST_NAME
+        done = load_manifest(manifest_path) if resume else {}
+        if done:
+            print(f"Resuming: {len(done)} page(s) listed in {manifest_path}")
+        print()
+        
+        # Three-stage pipeline: read + extract (process pool) -> format via API (async) -> write (thread).
+        # Bounded queues keep memory flat; sequence numbers keep the output in page order.
+        load_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        write_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        
+        async def reader():
+            loop = asyncio.get_running_loop()
+            
+            async def emit(seq, json_file, future):
+                try:
+                    firm_records = await future
+                except Exception as e:
+                    print(f"  ERROR reading JSON {json_file.name}: {e}")
+                    firm_records = None
+                await load_queue.put((seq, json_file, firm_records))
+            
+            # Keep a bounded window of files parsing in parallel, emitted in page order
+            with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+                in_flight = deque()
+                for seq, json_file in enumerate(json_files):
+                    in_flight.append((seq, json_file, loop.run_in_executor(executor, load_and_extract, json_file)))
+                    if len(in_flight) >= 2 * LOAD_WORKERS:
+                        await emit(*in_flight.popleft())
+                while in_flight:
+                    await emit(*in_flight.popleft())
+            
+            for _ in range(FORMAT_WORKERS):
+                await load_queue.put(None)
         
-        # Open output file in write mode
-        with open(output_file, 'w', encoding='utf-8') as out_f:
-            # Process each firm record
-            for firm_idx, firm_data in enumerate(firm_records, 1):
-                print(f"    [{firm_idx}/{len(firm_records)}] Formatting firm record...", end='', flush=True)
+        async def formatter():
+            while (item := await load_queue.get()) is not None:
+                seq, json_file, firm_records = item
+                print(f"[{seq + 1}/{len(json_files)}] Processing: {json_file.name}")
                 
-                # Format with OpenAI (prompt loaded from rag_formatting_prompt.txt)
-                formatted_text = format_for_rag(firm_data, model, client, source_name)
+                if not firm_records:
+                    if firm_records is not None:
+                        print(f"  No firm records found ({json_file.name})")
+                    await write_queue.put((seq, json_file, [], None))
+                    continue
                 
-                # Write to file immediately
-                out_f.write("="*80 + "\n")
-                out_f.write(f"FIRM RECORD {total_firms + firm_idx}\n")
-                out_f.write(f"Source: {json_file.name}, Record {firm_idx}\n")
-                out_f.write("="*80 + "\n\n")
-                out_f.write(formatted_text)
-                out_f.write("\n\n")
+                # Skip pages already written by an earlier run from the same inputs
+                digest = page_digest(f"{fast_model}>{model}" if fast_model else model, system_prompt,
+                                     user_template, firm_records)
+                entry = done.get(str(json_file.relative_to(input_path)))
+                if (entry is not None and entry["hash"] == digest
+                        and page_output_file(output_path, json_file).exists()):
+                    print(f"  Already formatted ({json_file.name}), skipping")
+                    await write_queue.put((seq, json_file, None, entry))
+                    continue
                 
-                # Flush to disk
-                out_f.flush()
+                # Format all records of this page concurrently (prompt loaded from rag_formatting_prompt.txt)
+                print(f"  Formatting {len(firm_records)} firm record(s) from {json_file.name}...", flush=True)
+                stats = Counter()
+                if records_per_request > 1:
+                    groups = group_records(firm_records, model, records_per_request)
+                    tasks = [format_for_rag_batch([firm_records[idx] for idx in group], model, client, semaphore,
+                                                  system_prompt, user_template, cache=cache, limiter=limiter,
+                                                  fast_model=fast_model, stats=stats)
+                             for group in groups]
+                else:
+                    groups = [[idx] for idx in range(len(firm_records))]
+                    tasks = [format_for_rag(firm_data, model, client, semaphore, system_prompt, user_template,
+                                            cache=cache, limiter=limiter, structured=structured,
+                                            fast_model=fast_model, stats=stats)
+                             for firm_data in firm_records]
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                if stats["escalated"]:
+                    print(f"  Escalated {stats['escalated']}/{len(firm_records)} record(s) to {model} ({json_file.name})")
                 
-                print(" ✓")
-                total_firms += 1
+                # A failed record keeps its slot so output order is preserved
+                formatted_texts = [None] * len(firm_records)
+                for group, result in zip(groups, results):
+                    if isinstance(result, Exception):
+                        print(f"❌ ERROR formatting record(s) from {json_file.name}: {result}\n")
+                        result = [f"[ERROR FORMATTING]\n{firm_records[idx]}" for idx in group]
+                    elif records_per_request <= 1:
+                        result = [result]
+                    for idx, text in zip(group, result):
+                        formatted_texts[idx] = text
+                await write_queue.put((seq, json_file, formatted_texts, digest))
+            await write_queue.put(None)
         
-        print(f"  Saved to: {output_file}\n")
-    
-    print("="*80)
-    print(f"Processing complete!")
-    print(f"Total firms processed: {total_firms}")
-    print(f"Output saved to: {output_path}")
-    print("="*80)
+        async def writer() -> int:
+            total_firms = 0
+            next_seq = 0
+            finished_workers = 0
+            pending = []  # heap of results that arrived ahead of next_seq
+            
+            with open(manifest_path, 'ab') as manifest_f:
+                while finished_workers < FORMAT_WORKERS:
+                    item = await write_queue.get()
+                    if item is None:
+                        finished_workers += 1
+                        continue
+                    heapq.heappush(pending, item)
+                    
+                    while pending and pending[0][0] == next_seq:
+                        # meta is the page digest, or the manifest entry of a resumed page
+                        _, json_file, formatted_texts, meta = heapq.heappop(pending)
+                        next_seq += 1
+                        if formatted_texts == []:
+                            continue
+                        
+                        # Create output file for this page
+                        output_file = page_output_file(output_path, json_file)
+                        key = str(json_file.relative_to(input_path))
+                        
+                        if formatted_texts is None:
+                            # Resumed page: already on disk, only its numbering may need shifting
+                            entry = meta
+                            if entry["first"] != total_firms + 1:
+                                await asyncio.to_thread(renumber_firm_records, output_file,
+                                                        entry["first"], total_firms + 1)
+                                manifest_f.write(json_dumps({**entry, "first": total_firms + 1}) + b"\n")
+                                manifest_f.flush()
+                            total_firms += entry["records"]
+                            continue
+                        
+                        await asyncio.to_thread(write_firm_records, output_file, json_file,
+                                                formatted_texts, total_firms + 1)
+                        # Pages with failed records are left out of the manifest so they are retried
+                        if not any(text.startswith("[ERROR FORMATTING]") for text in formatted_texts):
+                            manifest_f.write(json_dumps({"file": key, "hash": meta, "first": total_firms + 1,
+                                                         "records": len(formatted_texts)}) + b"\n")
+                            manifest_f.flush()
+                        total_firms += len(formatted_texts)
+                        print(f"  Saved to: {output_file}\n")
+            
+            return total_firms
+        
+        *_, total_firms = await asyncio.gather(
+            reader(), *(formatter() for _ in range(FORMAT_WORKERS)), writer()
+        )
+        
+        print("="*80)
+        print(f"Processing complete!")
+        print(f"Total firms processed: {total_firms}")
+        print(f"Output saved to: {output_path}")
+        print("="*80)
+    finally:
+        # Also closes the shared httpx client
+        await client.close()
+
+def positive_int(value: str) -> int:
+    """
+    argparse type for options that must be at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 def main():
     """
     Command line interface
     """
-    if len(sys.argv) < 3:
-        print("Usage: python json_to_rag_text.py <input_folder> <openai_model> [output_folder] [source_name] [api_key]")
-        print()
-        print("Arguments:")
-        print("  input_folder  : Folder containing page_N.json files")
-        print("  openai_model  : OpenAI model to use (e.g., gpt-4o, gpt-4-turbo, gpt-3.5-turbo)")
-        print("  output_folder : (Optional) Where to save output files (default: ./rag_output)")
-        print("  source_name   : (Optional) Source attribution (e.g., '1896 Compass', 'Budapest Stock Exchange Yearbook 1920')")
-        print("  api_key       : (Optional) OpenAI API key (default: from OPENAI_API_KEY env var)")
-        print()
-        print("Examples:")
-        print("  python json_to_rag_text.py ./data gpt-4o")
-        print("  python json_to_rag_text.py ./data gpt-4o ./output '1896 Compass'")
-        print("  python json_to_rag_text.py ./data gpt-4o ./output '1920 Budapest Stock Exchange Yearbook' sk-...")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Convert page_N.json firm records into RAG-friendly text using the OpenAI API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""Examples:
+  python json_to_rag_text.py ./data gpt-4o
+  python json_to_rag_text.py ./data gpt-4o ./output '1896 Compass'
+  python json_to_rag_text.py ./data gpt-4o ./output '1920 Budapest Stock Exchange Yearbook' sk-...
+  python json_to_rag_text.py ./data gpt-4o ./output --max-concurrency 20
+  python json_to_rag_text.py ./data gpt-4o ./output '1896 Compass' --batch"""
+    )
+    parser.add_argument("input_folder", help="Folder containing page_N.json files")
+    parser.add_argument("openai_model", help="OpenAI model to use (e.g., gpt-4o, gpt-4-turbo, gpt-3.5-turbo)")
+    parser.add_argument("output_folder", nargs="?", default="./rag_output",
+                        help="Where to save output files (default: ./rag_output)")
+    parser.add_argument("source_name", nargs="?", default=None,
+                        help="Source attribution (e.g., '1896 Compass', 'Budapest Stock Exchange Yearbook 1920')")
+    parser.add_argument("api_key", nargs="?", default=None,
+                        help="OpenAI API key (default: from OPENAI_API_KEY env var)")
+    parser.add_argument("--max-concurrency", type=positive_int, default=MAX_CONCURRENCY,
+                        help=f"Maximum number of concurrent OpenAI requests (default: {MAX_CONCURRENCY})")
+    parser.add_argument("--batch", action="store_true",
+                        help="Use the OpenAI Batch API (50%% cheaper, results within 24h)")
+    parser.add_argument("--records-per-request", type=positive_int, default=1,
+                        help="Pack up to this many firm records into one API request (default: 1)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't read or write the formatted-response cache")
+    parser.add_argument("--cache-path", default=None,
+                        help="Response cache database (default: <output_folder>/.format_cache.sqlite)")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Requests-per-minute limit to throttle to (default: unlimited)")
+    parser.add_argument("--tpm", type=float, default=None,
+                        help="Tokens-per-minute limit to throttle to (default: unlimited)")
+    parser.add_argument("--structured", action="store_true",
+                        help="Request JSON-schema structured output and render the text locally")
+    parser.add_argument("--no-resume", action="store_true",
+                        help=f"Re-format every page, ignoring the {MANIFEST_NAME} manifest of finished pages")
+    parser.add_argument("--fast-model", default=None,
+                        help="Cheaper model tried first for short records (e.g., gpt-4o-mini); "
+                             "failed outputs escalate to the escalation model")
+    parser.add_argument("--escalate-model", default=None,
+                        help="Model used for long records and escalations (default: openai_model)")
+    args = parser.parse_args()
     
-    input_folder = sys.argv[1]
-    model = sys.argv[2]
-    output_folder = sys.argv[3] if len(sys.argv) > 3 else "./rag_output"
-    source_name = sys.argv[4] if len(sys.argv) > 4 else None
-    api_key = sys.argv[5] if len(sys.argv) > 5 else os.getenv("OPENAI_API_KEY")
+    input_folder = args.input_folder
+    model = args.escalate_model or args.openai_model
+    output_folder = args.output_folder
+    source_name = args.source_name
+    api_key = args.api_key or os.getenv("OPENAI_API_KEY")
     
     if not api_key:
         print("ERROR: OpenAI API key not provided!")
@@ -239,10 +1120,27 @@ def main():
     print(f"Output folder: {output_folder}")
     if source_name:
         print(f"Source name: {source_name}")
+    if args.batch:
+        print("Mode: Batch API")
+        if args.fast_model:
+            print("⚠️  --fast-model is not supported with --batch; using the escalation model only")
+    else:
+        if args.fast_model:
+            print(f"Fast model: {args.fast_model} (records up to {FAST_MODEL_MAX_TOKENS} tokens)")
+        print(f"Max concurrency: {args.max_concurrency}")
+        if args.records_per_request > 1:
+            print(f"Records per request: up to {args.records_per_request}")
+        if args.rpm or args.tpm:
+            print(f"Rate limits: {args.rpm or 'unlimited'} RPM, {args.tpm or 'unlimited'} TPM")
     print(f"API key: {'*' * (len(api_key) - 4) + api_key[-4:]}")
     print()
     
-    process_json_files(input_folder, model, api_key, output_folder, source_name)
+    process_json_files(input_folder, model, api_key, output_folder, source_name,
+                       max_concurrency=args.max_concurrency, batch=args.batch,
+                       records_per_request=args.records_per_request,
+                       use_cache=not args.no_cache, cache_path=args.cache_path,
+                       rpm=args.rpm, tpm=args.tpm, structured=args.structured,
+                       resume=not args.no_resume, fast_model=args.fast_model)
 
 if __name__ == "__main__":
     main()
@@ -5,20 +5,97 @@ Converts JPG/PDF files to structured tables using GLM-4V model via Ollama
 """
 
 import os
+import argparse
 import json
+import re
 import base64
+import hashlib
+import io
+import mmap
 import subprocess
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import List, Dict, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from PIL import Image
 from pdf2image import convert_from_path
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=(orjson.OPT_INDENT_2 if indent else 0) | orjson.OPT_NON_STR_KEYS)
+except ImportError:  # fall back to the slower standard library parser
+    json_loads = json.loads
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
+try:
+    import fitz  # PyMuPDF: in-process renderer, faster than shelling out to poppler
+except ImportError:
+    fitz = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # CSVs are written through pandas
+    pa = None
+
+try:
+    import xlsxwriter  # noqa: F401
+    # Faster writer than openpyxl. No constant_memory: pandas writes cells column by
+    # column, and in that mode xlsxwriter drops writes to rows it has already passed
+    EXCEL_WRITER_KWARGS = {'engine': 'xlsxwriter'}
+except ImportError:
+    EXCEL_WRITER_KWARGS = {'engine': 'openpyxl'}
+
+try:
+    import pybase64
+    b64encode_as_string = pybase64.b64encode_as_string
+except ImportError:  # stdlib encoder plus a decode copy
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode('ascii')
+
+# Ollama HTTP API, and how many times to probe it (0.25s apart) while it starts
+OLLAMA_URL = "http://localhost:11434"
+OLLAMA_START_ATTEMPTS = 20
+
+# How long Ollama keeps the model loaded in VRAM after the last request
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Concurrent page requests; match the Ollama server's OLLAMA_NUM_PARALLEL setting
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 2))
+
+# Files processed at once in worker processes; they split the OLLAMA_NUM_PARALLEL
+# request budget. Each worker holds a whole PDF rendered at 300 DPI in memory
+# (roughly 25 MB per A4 page), so keep this small
+FILE_WORKERS = int(os.environ.get("OCR_FILE_WORKERS", 2))
+
+# Markdown code fence around the model's JSON answer, and the decoder that reads
+# the first JSON object inside it
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_JSON_DECODER = json.JSONDecoder()
+
+# Pages are downscaled to this long edge (GLM-4V's native tile grid) and
+# re-encoded before upload; fewer bytes and fewer vision tokens
+MAX_IMAGE_EDGE = 1568
+UPLOAD_JPEG_QUALITY = 85
+
+# Part of the response cache key; bump when the extraction prompt changes
+PROMPT_VERSION = "v1"
+
 
 class GLMOCRTableExtractor:
     """Extract tables from images and PDFs using GLM-4V model"""
     
-    def __init__(self, model_name: str = "glm-ocr", data_dir: str = "/home/data", output_dir: str = "/home/output"):
+    def __init__(self, model_name: str = "glm-ocr", data_dir: str = "/home/data", output_dir: str = "/home/output",
+                 page_workers: int = OLLAMA_NUM_PARALLEL):
         """
         Initialize the table extractor
         
@@ -26,31 +103,64 @@ class GLMOCRTableExtractor:
             model_name: Name of the Ollama model to use
             data_dir: Directory containing input files
             output_dir: Directory for output files
+            page_workers: Concurrent page requests to Ollama
         """
         self.model_name = model_name
+        self.page_workers = page_workers
         self.output_dir = Path(output_dir)
         self.data_dir = Path(data_dir)
         self.output_dir.mkdir(exist_ok=True, parents=True)
         
+        # Parsed model responses, keyed by image content, model and prompt version
+        self.cache_dir = self.output_dir / ".cache"
+        self.cache_dir.mkdir(exist_ok=True)
+        
+        # One keep-alive session for all Ollama calls (no TCP handshake per page)
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0))
+        self.session.headers.update({'Connection': 'keep-alive', 'Accept-Encoding': 'gzip, deflate'})
+        
+        # Pages are extracted in worker threads; keeps their messages from interleaving
+        self._print_lock = threading.Lock()
+        
+    def log(self, *args, **kwargs):
+        """Thread-safe print"""
+        with self._print_lock:
+            print(*args, **kwargs)
+        
     def ensure_ollama_running(self):
-        """Ensure Ollama service is running"""
+        """Ensure Ollama service is running (returns as soon as the API answers)"""
+        for attempt in range(OLLAMA_START_ATTEMPTS):
+            try:
+                self.session.get(f"{OLLAMA_URL}/api/tags", timeout=0.5)
+                return
+            except requests.RequestException:
+                pass
+            if attempt == 0:
+                print("Starting Ollama service...")
+                try:
+                    subprocess.Popen(
+                        ["ollama", "serve"],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL
+                    )
+                except OSError as e:
+                    print(f"Warning: Could not start Ollama: {e}")
+                    return
+            time.sleep(0.25)
+        print(f"Warning: Ollama is not responding at {OLLAMA_URL}")
+    
+    def warmup(self):
+        """Load the model before the first page so no page pays the cold-start cost"""
+        print(f"Loading model {self.model_name}...")
         try:
-            result = subprocess.run(
-                ["pgrep", "-f", "ollama serve"],
-                capture_output=True,
-                text=True
+            self.session.post(
+                f"{OLLAMA_URL}/api/generate",
+                json={"model": self.model_name, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE, "stream": False},
+                timeout=600
             )
-            if result.returncode != 0:
-                print("Starting Ollama service...")
-                subprocess.Popen(
-                    ["ollama", "serve"],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                import time
-                time.sleep(3)
-        except Exception as e:
-            print(f"Warning: Could not check Ollama status: {e}")
+        except requests.RequestException as e:
+            print(f"Warning: Could not preload model: {e}")
     
     def image_to_base64(self, image_path: Union[str, Path]) -> str:
         """
@@ -63,7 +173,43 @@ class GLMOCRTableExtractor:
             Base64 encoded image string
         """
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return b64encode_as_string(image_file.read())
+    
+    def cache_path(self, image_bytes: Union[bytes, mmap.mmap]) -> Path:
+        """
+        Response cache file for an image
+        
+        Args:
+            image_bytes: Raw image file contents (any bytes-like object)
+            
+        Returns:
+            Path of the cached JSON result
+        """
+        key = hashlib.sha256(image_bytes).hexdigest()
+        return self.cache_dir / f"{self.model_name.replace(':', '_')}_{PROMPT_VERSION}_{key}.json"
+    
+    def render_pdf_pages(self, pdf_path: Union[str, Path], dpi: int = 300) -> List[Image.Image]:
+        """
+        Render all pages of a PDF
+        
+        Args:
+            pdf_path: Path to the PDF file
+            dpi: Rendering resolution
+            
+        Returns:
+            List of page images
+        """
+        if fitz is None:
+            # Poppler renders page ranges in parallel
+            return convert_from_path(pdf_path, dpi=dpi, thread_count=os.cpu_count() or 1)
+        
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        images = []
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pix = page.get_pixmap(matrix=matrix, alpha=False)
+                images.append(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+        return images
     
     def pdf_to_images(self, pdf_path: Union[str, Path]) -> List[Path]:
         """
@@ -80,13 +226,12 @@ class GLMOCRTableExtractor:
         output_folder.mkdir(exist_ok=True)
         
         print(f"Converting PDF to images: {pdf_path.name}")
-        images = convert_from_path(pdf_path, dpi=300)
+        images = self.render_pdf_pages(pdf_path)
         
-        image_paths = []
-        for i, image in enumerate(images):
-            image_path = output_folder / f"page_{i+1}.jpg"
-            image.save(image_path, "JPEG")
-            image_paths.append(image_path)
+        # JPEG encoding runs in threads (PIL releases the GIL while encoding)
+        image_paths = [output_folder / f"page_{i+1}.jpg" for i in range(len(images))]
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda image, image_path: image.save(image_path, "JPEG"), images, image_paths))
             
         print(f"Converted {len(images)} pages")
         return image_paths
@@ -102,7 +247,74 @@ class GLMOCRTableExtractor:
             Dictionary containing extracted table data
         """
         image_path = Path(image_path)
-        print(f"\nProcessing: {image_path.name}")
+        with Image.open(image_path) as image:
+            oversized = max(image.size) > MAX_IMAGE_EDGE
+            if oversized:
+                cache_path, image_b64 = self.encode_image(self.prepare_image(image))
+        if not oversized:
+            # Already small enough: send the file as is, encoding straight from a
+            # read-only mapping instead of copying it into a bytes object first
+            with open(image_path, "rb") as img_file, \
+                    mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+                cache_path, image_b64 = self.encode_image(image_map)
+        # Image buffers are released here, before the (slow) request
+        return self.extract_from_base64(cache_path, image_b64, image_path.name)
+    
+    def extract_from_pil(self, image: Image.Image, name: str) -> Dict:
+        """
+        Extract table from an in-memory page image, without writing it to disk
+        
+        Args:
+            image: Rendered page image
+            name: Page name used in log messages
+            
+        Returns:
+            Dictionary containing extracted table data
+        """
+        cache_path, image_b64 = self.encode_image(self.prepare_image(image))
+        return self.extract_from_base64(cache_path, image_b64, name)
+    
+    def prepare_image(self, image: Image.Image) -> bytes:
+        """
+        Downscale an image to MAX_IMAGE_EDGE and encode it as JPEG for upload
+        
+        Args:
+            image: Page image
+            
+        Returns:
+            JPEG file contents
+        """
+        image = image.convert("RGB") if image.mode not in ("RGB", "L") else image.copy()
+        image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+        buf = io.BytesIO()
+        image.save(buf, format='JPEG', quality=UPLOAD_JPEG_QUALITY, optimize=True)
+        return buf.getvalue()
+    
+    def encode_image(self, image_data: Union[bytes, mmap.mmap]) -> Tuple[Path, str]:
+        """
+        Hash and base64-encode image data for upload
+        
+        Args:
+            image_data: JPEG/PNG file contents (any bytes-like object)
+            
+        Returns:
+            Response cache path and base64 encoded image string
+        """
+        return self.cache_path(image_data), b64encode_as_string(image_data)
+    
+    def extract_from_base64(self, cache_path: Path, image_b64: str, name: str) -> Dict:
+        """
+        Extract table from an encoded image using GLM-4V via Ollama
+        
+        Args:
+            cache_path: Response cache file for the image (see cache_path)
+            image_b64: Base64 encoded image string
+            name: Image name used in log messages
+            
+        Returns:
+            Dictionary containing extracted table data
+        """
+        self.log(f"\nProcessing: {name}")
         
         # Prepare the prompt for table extraction
         prompt = """Analyze this image and extract any tables you find. 
@@ -128,68 +340,114 @@ Return the result as a JSON object with this structure:
 If no tables are found, return: {"tables": [], "note": "No tables detected"}
 """
         
-        # Read and encode image
-        with open(image_path, "rb") as img_file:
-            image_b64 = base64.b64encode(img_file.read()).decode('utf-8')
+        # Unchanged images are answered from the cache without inference
+        if cache_path.exists():
+            self.log(f"Using cached result for {name}")
+            with open(cache_path, 'rb') as f:
+                return json_loads(f.read())
         
         # Call Ollama API
         try:
-            cmd = [
-                "ollama", "run", self.model_name,
-                prompt
-            ]
-            
             # Note: Ollama CLI doesn't directly support image input via command line
             # We need to use the API endpoint instead
-            import requests
-            
-            response = requests.post(
-                "http://localhost:11434/api/generate",
+            # Streamed NDJSON: the connection goes back to the pool on the final chunk
+            with self.session.post(
+                f"{OLLAMA_URL}/api/generate",
                 json={
                     "model": self.model_name,
                     "prompt": prompt,
                     "images": [image_b64],
-                    "stream": False
-                }
-            )
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "stream": True
+                },
+                stream=True
+            ) as response:
+                status_code = response.status_code
+                if status_code == 200:
+                    response_text = self.read_stream(response)
             
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result.get("response", "")
-                print(f"Model response received ({len(response_text)} chars)")
+            if status_code == 200:
+                self.log(f"Model response received ({len(response_text)} chars)")
                 
                 # Try to parse JSON from response
                 try:
-                    # Extract JSON from markdown code blocks if present
-                    if "```json" in response_text:
-                        json_start = response_text.find("```json") + 7
-                        json_end = response_text.find("```", json_start)
-                        response_text = response_text[json_start:json_end].strip()
-                    elif "```" in response_text:
-                        json_start = response_text.find("```") + 3
-                        json_end = response_text.find("```", json_start)
-                        response_text = response_text[json_start:json_end].strip()
+                    # Extract JSON from markdown code blocks if present, then decode the
+                    # first object (ignores any text the model adds around it)
+                    fence = _JSON_FENCE.search(response_text)
+                    if fence:
+                        response_text = fence.group(1).strip()
+                    json_start = response_text.find("{")
+                    if json_start < 0:
+                        raise json.JSONDecodeError("No JSON object found", response_text, 0)
+                    try:
+                        # Common case: the object is the whole payload
+                        table_data = json_loads(response_text[json_start:])
+                    except ValueError:
+                        table_data, _ = _JSON_DECODER.raw_decode(response_text, json_start)
                     
-                    table_data = json.loads(response_text)
+                    self.write_cache(cache_path, table_data)
                     return table_data
                 except json.JSONDecodeError:
-                    print("Warning: Could not parse JSON response, returning raw text")
+                    self.log("Warning: Could not parse JSON response, returning raw text")
                     return {
                         "tables": [],
                         "raw_response": response_text,
                         "note": "Failed to parse structured data"
                     }
             else:
-                print(f"Error: API returned status {response.status_code}")
-                return {"tables": [], "error": f"API error: {response.status_code}"}
+                self.log(f"Error: API returned status {status_code}")
+                return {"tables": [], "error": f"API error: {status_code}"}
                 
         except requests.exceptions.ConnectionError:
-            print("Error: Could not connect to Ollama. Make sure Ollama is running.")
+            self.log("Error: Could not connect to Ollama. Make sure Ollama is running.")
             return {"tables": [], "error": "Connection failed"}
         except Exception as e:
-            print(f"Error calling Ollama: {e}")
+            self.log(f"Error calling Ollama: {e}")
             return {"tables": [], "error": str(e)}
     
+    def write_cache(self, cache_path: Path, table_data: Dict):
+        """
+        Store a parsed result in the response cache; failures only log a warning
+        
+        Args:
+            cache_path: Response cache file for the image
+            table_data: Parsed extraction result
+        """
+        # Unique temp file per writer (identical pages share a key, also across
+        # worker processes), then an atomic rename so readers never see a partial file
+        tmp_name = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp', delete=False) as f:
+                tmp_name = f.name
+                f.write(json_dumps(table_data))
+            os.replace(tmp_name, cache_path)
+        except OSError as e:
+            self.log(f"Warning: Could not write cache file {cache_path.name}: {e}")
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+    
+    def read_stream(self, response: requests.Response) -> str:
+        """
+        Collect the generated text from a streaming /api/generate response
+        
+        Args:
+            response: Response opened with stream=True
+            
+        Returns:
+            Full generated text
+        """
+        parts = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json_loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            parts.append(chunk.get("response", ""))
+            if chunk.get("done"):
+                break
+        return "".join(parts)
+    
     def save_tables_to_excel(self, table_data: Dict, output_path: Union[str, Path]):
         """
         Save extracted tables to Excel file
@@ -202,28 +460,48 @@ If no tables are found, return: {"tables": [], "note": "No tables detected"}
         
         if not table_data.get("tables"):
             print("No tables to save")
-            # Save raw response if available
-            if "raw_response" in table_data:
-                txt_path = output_path.with_suffix('.txt')
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(table_data["raw_response"])
-                print(f"Saved raw response to: {txt_path}")
+            self.save_raw_response(table_data, output_path)
             return
         
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            for table in table_data["tables"]:
-                table_num = table.get("table_number", 1)
-                headers = table.get("headers", [])
-                rows = table.get("rows", [])
-                
-                if rows:
-                    df = pd.DataFrame(rows, columns=headers if headers else None)
-                    sheet_name = f"Table_{table_num}"
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    print(f"Saved table {table_num} with {len(rows)} rows")
+        with pd.ExcelWriter(output_path, **EXCEL_WRITER_KWARGS) as writer:
+            self.write_tables_to_sheets(writer, table_data)
         
         print(f"Excel file saved: {output_path}")
     
+    def write_tables_to_sheets(self, writer: pd.ExcelWriter, table_data: Dict, page: int = None):
+        """
+        Write extracted tables as sheets of an open workbook
+        
+        Args:
+            writer: Open Excel writer
+            table_data: Dictionary containing table data
+            page: Page number, prefixed to sheet names when several pages share a workbook
+        """
+        for table in table_data["tables"]:
+            table_num = table.get("table_number", 1)
+            headers = table.get("headers", [])
+            rows = table.get("rows", [])
+            
+            if rows:
+                df = pd.DataFrame(rows, columns=headers if headers else None)
+                sheet_name = f"page{page}_table{table_num}" if page else f"Table_{table_num}"
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+                print(f"Saved table {table_num} with {len(rows)} rows")
+    
+    def save_raw_response(self, table_data: Dict, output_path: Union[str, Path]):
+        """
+        Save the model's raw response (if any) next to output_path, for pages that failed to parse
+        
+        Args:
+            table_data: Dictionary containing table data
+            output_path: Output path whose suffix is replaced with .txt
+        """
+        if "raw_response" in table_data:
+            txt_path = Path(output_path).with_suffix('.txt')
+            with open(txt_path, 'w', encoding='utf-8') as f:
+                f.write(table_data["raw_response"])
+            print(f"Saved raw response to: {txt_path}")
+    
     def save_tables_to_csv(self, table_data: Dict, output_base_path: Union[str, Path]):
         """
         Save extracted tables to CSV files
@@ -244,68 +522,166 @@ If no tables are found, return: {"tables": [], "note": "No tables detected"}
             rows = table.get("rows", [])
             
             if rows:
-                df = pd.DataFrame(rows, columns=headers if headers else None)
                 csv_path = output_base_path.parent / f"{output_base_path.stem}_table{table_num}.csv"
-                df.to_csv(csv_path, index=False, encoding='utf-8')
+                if pa is not None and headers and all(
+                        isinstance(row, (list, tuple)) and len(row) == len(headers) for row in rows):
+                    # Columnar C++ writer; every value as text since model output mixes types.
+                    # Unlike pandas, pyarrow quotes every string field - same data, different quoting
+                    columns = [pa.array([None if v is None else str(v) for v in column], type=pa.string())
+                               for column in zip(*rows)]
+                    pacsv.write_csv(pa.Table.from_arrays(columns, names=[str(h) for h in headers]), str(csv_path))
+                else:
+                    df = pd.DataFrame(rows, columns=headers if headers else None)
+                    df.to_csv(csv_path, index=False, encoding='utf-8')
                 print(f"Saved table {table_num} to: {csv_path}")
     
-    def process_file(self, file_path: Union[str, Path], output_format: str = "excel"):
+    def expected_outputs(self, file_path: Path, results: List[Dict], output_format: str,
+                         save_images: bool) -> List[Path]:
+        """
+        Files a run with these options writes for the given results
+        (excel workbook or per-table CSVs, plus page JPEGs when save_images is set for a PDF)
+        """
+        paths = []
+        if output_format == "excel":
+            if any(page["data"].get("tables") for page in results):
+                paths.append(self.output_dir / f"{file_path.stem}.xlsx")
+        else:
+            for page in results:
+                for table in page["data"].get("tables") or []:
+                    if table.get("rows"):
+                        paths.append(self.output_dir /
+                                     f"{file_path.stem}_page{page['page']}_table{table.get('table_number', 1)}.csv")
+        if save_images and file_path.suffix.lower() == '.pdf':
+            paths.extend(self.output_dir / file_path.stem / f"page_{page['page']}.jpg" for page in results)
+        return paths
+    
+    def process_file(self, file_path: Union[str, Path], output_format: str = "excel", save_images: bool = False,
+                     force: bool = False) -> List[Dict]:
         """
         Process a single file (JPG or PDF)
         
         Args:
             file_path: Path to the input file
             output_format: Output format ('excel' or 'csv')
+            save_images: Also write rendered PDF pages to disk as JPEGs
+            force: Re-extract even if results newer than the input file exist
+            
+        Returns:
+            Per-page extraction results
         """
         file_path = Path(file_path)
         
         if not file_path.exists():
             print(f"Error: File not found: {file_path}")
-            return
+            return []
+        
+        # Results already written after the input last changed, with no failed pages: nothing to do
+        json_path = self.output_dir / f"{file_path.stem}_results.json"
+        if not force and json_path.exists() and json_path.stat().st_mtime >= file_path.stat().st_mtime:
+            with open(json_path, 'rb') as f:
+                stored_results = json_loads(f.read())
+            missing = [path for path in self.expected_outputs(file_path, stored_results, output_format, save_images)
+                       if not path.exists()]
+            if any("error" in page["data"] for page in stored_results):
+                print(f"Previous results for {file_path.name} have failed pages, re-processing")
+            elif missing:
+                print(f"Previous results for {file_path.name} lack {missing[0].name}, re-processing")
+            else:
+                print(f"Skipping {file_path.name}: results already in {json_path} (use --force to redo)")
+                return stored_results
         
         print(f"\n{'='*60}")
         print(f"Processing: {file_path.name}")
         print(f"{'='*60}")
         
-        # Handle PDF files
-        if file_path.suffix.lower() == '.pdf':
-            image_paths = self.pdf_to_images(file_path)
+        # Handle PDF files; pages stay in memory unless save_images is set
+        if file_path.suffix.lower() == '.pdf' and not save_images:
+            print(f"Converting PDF to images: {file_path.name}")
+            images = self.render_pdf_pages(file_path)
+            print(f"Converted {len(images)} pages")
+            # No page image on disk: results record the PDF and page number instead
+            image_paths = [None] * len(images)
+            pages = [(image, f"{file_path.name} page {i+1}") for i, image in enumerate(images)]
+            extract = self.extract_from_pil
         else:
-            image_paths = [file_path]
+            image_paths = self.pdf_to_images(file_path) if file_path.suffix.lower() == '.pdf' else [file_path]
+            pages = [(image_path,) for image_path in image_paths]
+            extract = self.extract_table_with_glm
         
-        # Process each image
+        # Extract pages concurrently (Ollama batches parallel requests on the GPU);
+        # results are consumed in page order so saving overlaps with later pages
         all_results = []
-        for i, image_path in enumerate(image_paths):
-            print(f"\nPage {i+1}/{len(image_paths)}")
-            table_data = self.extract_table_with_glm(image_path)
-            all_results.append({
-                "page": i+1,
-                "image_path": str(image_path),
-                "data": table_data
-            })
-            
-            # Save individual page results
-            base_name = f"{file_path.stem}_page{i+1}"
-            if output_format == "excel":
-                output_path = self.output_dir / f"{base_name}.xlsx"
-                self.save_tables_to_excel(table_data, output_path)
-            else:
-                output_path = self.output_dir / base_name
-                self.save_tables_to_csv(table_data, output_path)
+        # Excel output goes to one workbook per document, opened at the first table
+        workbook_path = self.output_dir / f"{file_path.stem}.xlsx"
+        writer = None
+        try:
+            with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+                futures = [executor.submit(extract, *page) for page in pages]
+                for i, (image_path, future) in enumerate(zip(image_paths, futures)):
+                    table_data = future.result()
+                    self.log(f"\nPage {i+1}/{len(image_paths)}")
+                    all_results.append({
+                        "page": i+1,
+                        "source_path": str(file_path),
+                        "image_path": str(image_path) if image_path is not None else None,
+                        "data": table_data
+                    })
+                    
+                    # Save individual page results
+                    base_name = f"{file_path.stem}_page{i+1}"
+                    with self._print_lock:
+                        if output_format != "excel":
+                            output_path = self.output_dir / base_name
+                            self.save_tables_to_csv(table_data, output_path)
+                        elif table_data.get("tables"):
+                            if writer is None:
+                                writer = pd.ExcelWriter(workbook_path, **EXCEL_WRITER_KWARGS)
+                            self.write_tables_to_sheets(writer, table_data, page=i+1)
+                        else:
+                            print("No tables to save")
+                            self.save_raw_response(table_data, self.output_dir / f"{base_name}.txt")
+        finally:
+            if writer is not None:
+                writer.close()
+                print(f"Excel file saved: {workbook_path}")
         
         # Save combined JSON results
-        json_path = self.output_dir / f"{file_path.stem}_results.json"
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(all_results, f, indent=2, ensure_ascii=False)
+        with open(json_path, 'wb') as f:
+            f.write(json_dumps(all_results, indent=True))
         print(f"\nSaved combined results to: {json_path}")
         
         print(f"\n{'='*60}")
         print(f"Processing complete for: {file_path.name}")
         print(f"{'='*60}\n")
+        return all_results
+
+
+def _process_one(file_path: Path, model_name: str, data_dir: str, output_dir: str,
+                 save_images: bool = False, force: bool = False, page_workers: int = OLLAMA_NUM_PARALLEL) -> int:
+    """
+    Process one file in a worker process with its own extractor
+    (the extractor's requests session can't be pickled)
+    
+    Returns:
+        Number of pages processed
+    """
+    extractor = GLMOCRTableExtractor(model_name=model_name, data_dir=data_dir, output_dir=output_dir,
+                                     page_workers=page_workers)
+    return len(extractor.process_file(file_path, output_format="excel", save_images=save_images, force=force))
 
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="Extract tables from JPG/PDF files with GLM-4V via Ollama")
+    parser.add_argument("--save-images", action="store_true",
+                        help="Write rendered PDF pages to the output folder as JPEGs")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-process files whose results are already up to date")
+    parser.add_argument("--file-workers", type=int, default=FILE_WORKERS,
+                        help=f"Files processed in parallel (default: {FILE_WORKERS}, or OCR_FILE_WORKERS); "
+                             "each holds a rendered PDF in memory")
+    args = parser.parse_args()
+    
     print("GLM-OCR Table Extraction Tool")
     print("="*60)
     
@@ -314,6 +690,7 @@ def main():
     
     # Ensure Ollama is running
     extractor.ensure_ollama_running()
+    extractor.warmup()
     
     # Find files to process
     data_dir = extractor.data_dir
@@ -336,14 +713,26 @@ def main():
     for f in files_to_process:
         print(f"  - {f.name}")
     
-    # Process each file
-    for file_path in files_to_process:
-        try:
-            extractor.process_file(file_path, output_format="excel")
-        except Exception as e:
-            print(f"Error processing {file_path.name}: {e}")
-            import traceback
-            traceback.print_exc()
+    # Process files in parallel worker processes sharing the Ollama server, so one
+    # file's PDF rendering overlaps with GPU inference for another. The workers split
+    # the OLLAMA_NUM_PARALLEL request budget so the server isn't oversubscribed
+    max_workers = max(1, min(len(files_to_process), args.file_workers))
+    page_workers = max(1, OLLAMA_NUM_PARALLEL // max_workers)
+    print(f"\nUsing {max_workers} file worker(s) with {page_workers} concurrent page request(s) each")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_process_one, file_path, extractor.model_name, str(extractor.data_dir),
+                            str(extractor.output_dir), args.save_images, args.force, page_workers): file_path
+            for file_path in files_to_process
+        }
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # The worker's traceback is attached to the exception
+                print(f"Error processing {file_path.name}: {e}")
+                traceback.print_exc()
     
     print("\n" + "="*60)
     print("All files processed!")
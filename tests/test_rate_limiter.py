@@ -0,0 +1,60 @@
+"""
+Tests for json_to_rag_text.RateLimiter with a single limit enabled
+"""
+
+import asyncio
+import math
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import json_to_rag_text
+
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep; sleeping only advances the clock"""
+    
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    
+    def run_acquires(self, limiter_args, tokens, count):
+        clock = FakeClock()
+        with mock.patch.object(json_to_rag_text.time, "monotonic", clock.monotonic), \
+                mock.patch.object(json_to_rag_text.asyncio, "sleep", clock.sleep):
+            async def run():
+                limiter = json_to_rag_text.RateLimiter(*limiter_args)
+                for _ in range(count):
+                    await limiter.acquire(tokens)
+            asyncio.run(run())
+        return clock
+    
+    def test_tpm_only_waits_for_token_refill(self):
+        # 6000 TPM bucket: the second 6000-token request waits a full minute
+        clock = self.run_acquires((None, 6000), tokens=6000, count=2)
+        self.assertTrue(all(math.isfinite(s) and s > 0 for s in clock.sleeps))
+        self.assertLessEqual(len(clock.sleeps), 2)
+        self.assertAlmostEqual(clock.now, 60.0, places=3)
+    
+    def test_rpm_only_waits_for_request_refill(self):
+        # 60 RPM bucket: requests 61 and 62 wait one second each
+        clock = self.run_acquires((60, None), tokens=10**6, count=62)
+        self.assertTrue(all(math.isfinite(s) and s > 0 for s in clock.sleeps))
+        self.assertLessEqual(len(clock.sleeps), 4)
+        self.assertAlmostEqual(clock.now, 2.0, places=3)
+
+
+if __name__ == "__main__":
+    unittest.main()